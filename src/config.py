@@ -2,74 +2,118 @@
 config.py
 
 Módulo para cargar y exponer variables de entorno y configuraciones
-relacionadas con la aplicación. Lee datos de .env (claves, URL, modelo, mapeos, etc.)
-y maneja logs para advertir si hay problemas con parseos JSON.
+relacionadas con la aplicación. Lee datos de .env (claves, URL, modelo, mapeos, etc.) de forma diferida,
+la primera vez que se accede a un valor, y maneja logs para advertir
+si hay problemas con parseos JSON.
 
 Autor: JoseAAA
 """
 
 import os
-import json
+try:
+    import orjson as _json  # Parser JSON más rápido, si está instalado
+except ImportError:
+    import json as _json
 import logging
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
 from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
-# Cargar variables de entorno desde .env
-load_dotenv()
-
 # -------------------------------------------------------
-# Credenciales y configuraciones de la API
+# Rutas de datos
 # -------------------------------------------------------
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
-OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com")
-OPENAI_API_MODEL = os.getenv("OPENAI_API_MODEL", "gpt-3.5-turbo")
-LANGUAGE = os.getenv("LANGUAGE", "es")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data")
+# Caché persistente de emociones ya clasificadas (SQLite)
+EMOTION_CACHE_PATH = os.path.join(DATA_DIR, ".emotion_cache.sqlite")
 
-if not OPENAI_API_KEY:
-    logger.error("Falta configurar 'OPENAI_API_KEY' en .env.")
-    raise ValueError("Falta configurar 'OPENAI_API_KEY' en .env.")
 
-# -------------------------------------------------------
-# Mapeos de remitentes en formato JSON
-# -------------------------------------------------------
-whatsapp_mapping_str = os.getenv("WHATSAPP_SENDER_MAPPING", "{}")
-telegram_mapping_str = os.getenv("TELEGRAM_SENDER_MAPPING", "{}")
-SENDER_FALLBACK = os.getenv("SENDER_FALLBACK", "Otro")
+@dataclass(frozen=True)
+class Config:
+    """
+    Configuración de la aplicación leída desde .env.
 
-try:
-    WHATSAPP_SENDER_MAPPING = json.loads(whatsapp_mapping_str)
-except json.JSONDecodeError:
-    logger.warning("No se pudo parsear WHATSAPP_SENDER_MAPPING como JSON. Usando {} por defecto.")
-    WHATSAPP_SENDER_MAPPING = {}
+    Los nombres de los campos coinciden con las constantes que expone el módulo
+    (por ejemplo, config.OPENAI_API_KEY es get_config().OPENAI_API_KEY).
+    """
+    OPENAI_API_KEY: str
+    OPENAI_API_BASE: str
+    OPENAI_API_MODEL: str
+    LANGUAGE: str
+    WHATSAPP_SENDER_MAPPING: dict = field(default_factory=dict)
+    TELEGRAM_SENDER_MAPPING: dict = field(default_factory=dict)
+    SENDER_FALLBACK: str = "Otro"
+    CUSTOM_STOPWORDS: set = field(default_factory=set)
+    VALID_EMOTIONS: list = field(default_factory=list)
+    UNKNOWN_EMOTION_LABEL: str = "Neutro"
 
-try:
-    TELEGRAM_SENDER_MAPPING = json.loads(telegram_mapping_str)
-except json.JSONDecodeError:
-    logger.warning("No se pudo parsear TELEGRAM_SENDER_MAPPING como JSON. Usando {} por defecto.")
-    TELEGRAM_SENDER_MAPPING = {}
 
-# -------------------------------------------------------
-# Stopwords personalizadas, emociones, etiqueta desconocida
-# -------------------------------------------------------
-custom_stopwords_str = os.getenv("CUSTOM_STOPWORDS", "[]")
-try:
-    CUSTOM_STOPWORDS = set(json.loads(custom_stopwords_str))
-except json.JSONDecodeError:
-    logger.warning("No se pudo parsear CUSTOM_STOPWORDS como JSON. Usando set() por defecto.")
-    CUSTOM_STOPWORDS = set()
+def _parse_json_env(name: str, default_str: str, default, description: str):
+    """
+    Lee una variable de entorno en formato JSON. Si no se puede parsear,
+    registra una advertencia y devuelve 'default'.
+    """
+    try:
+        return _json.loads(os.getenv(name, default_str))
+    except _json.JSONDecodeError:
+        logger.warning(f"No se pudo parsear {name} como JSON. Usando {description} por defecto.")
+        return default
 
-valid_emotions_str = os.getenv("VALID_EMOTIONS", "[]")
-try:
-    VALID_EMOTIONS = json.loads(valid_emotions_str)
-except json.JSONDecodeError:
-    logger.warning("No se pudo parsear VALID_EMOTIONS como JSON. Usando lista vacía por defecto.")
-    VALID_EMOTIONS = []
 
-UNKNOWN_EMOTION_LABEL = os.getenv("UNKNOWN_EMOTION_LABEL", "Neutro")
+@lru_cache(maxsize=None)
+def get_config() -> Config:
+    """
+    Carga .env y construye la configuración la primera vez que se necesita;
+    las llamadas siguientes devuelven la misma instancia.
 
-# -------------------------------------------------------
-# Rutas de datos
-# -------------------------------------------------------
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DATA_DIR = os.path.join(BASE_DIR, "data")
+    Returns:
+        Config: Configuración de la aplicación.
+
+    Raises:
+        ValueError: Si falta 'OPENAI_API_KEY' en .env.
+    """
+    # Cargar variables de entorno desde .env
+    load_dotenv()
+
+    # -------------------------------------------------------
+    # Credenciales y configuraciones de la API
+    # -------------------------------------------------------
+    api_key = os.getenv("OPENAI_API_KEY", "")
+    if not api_key:
+        logger.error("Falta configurar 'OPENAI_API_KEY' en .env.")
+        raise ValueError("Falta configurar 'OPENAI_API_KEY' en .env.")
+
+    return Config(
+        OPENAI_API_KEY=api_key,
+        OPENAI_API_BASE=os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1"),
+        OPENAI_API_MODEL=os.getenv("OPENAI_API_MODEL", "gpt-3.5-turbo"),
+        LANGUAGE=os.getenv("LANGUAGE", "es"),
+        # -------------------------------------------------------
+        # Mapeos de remitentes en formato JSON
+        # -------------------------------------------------------
+        WHATSAPP_SENDER_MAPPING=_parse_json_env("WHATSAPP_SENDER_MAPPING", "{}", {}, "{}"),
+        TELEGRAM_SENDER_MAPPING=_parse_json_env("TELEGRAM_SENDER_MAPPING", "{}", {}, "{}"),
+        SENDER_FALLBACK=os.getenv("SENDER_FALLBACK", "Otro"),
+        # -------------------------------------------------------
+        # Stopwords personalizadas, emociones, etiqueta desconocida
+        # -------------------------------------------------------
+        CUSTOM_STOPWORDS=set(_parse_json_env("CUSTOM_STOPWORDS", "[]", [], "set()")),
+        VALID_EMOTIONS=_parse_json_env("VALID_EMOTIONS", "[]", [], "lista vacía"),
+        UNKNOWN_EMOTION_LABEL=os.getenv("UNKNOWN_EMOTION_LABEL", "Neutro"),
+    )
+
+
+_CONFIG_FIELDS = frozenset(f.name for f in fields(Config))
+
+
+def __getattr__(name: str):
+    """
+    Expone los campos de Config como constantes del módulo, de modo que
+    'from config import VALID_EMOTIONS' sigue funcionando pero .env solo
+    se lee cuando realmente se usa un valor.
+    """
+    if name in _CONFIG_FIELDS:
+        return getattr(get_config(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
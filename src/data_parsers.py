@@ -10,13 +10,28 @@ Autor: JoseAAA
 
 import os
 import re
+import mmap
 import datetime
 import logging
 import pandas as pd
-from bs4 import BeautifulSoup
 
 logger = logging.getLogger(__name__)
 
+WHATSAPP_LINE_PATTERN = re.compile(
+    r'^(?P<date>\d{1,2}\/\d{1,2}\/\d{4}),\s*(?P<time>\d{1,2}:\d{2}\s?[ap]\.?m\.?)\s*-\s*(?P<content>.*)$',
+    re.IGNORECASE
+)
+# Sufijo a.m./p.m. en cualquiera de sus variantes ("a. m.", "am", "P.M.") o espacios sueltos
+WHATSAPP_TIME_FIX = re.compile(r'\s*([ap])\.?\s*m\.?\s*|\s+', re.IGNORECASE)
+
+
+def _normalize_meridiem(match: re.Match) -> str:
+    """
+    Reemplazo para WHATSAPP_TIME_FIX: 'AM'/'PM' para el sufijo y '' para espacios.
+    """
+    meridiem = match.group(1)
+    return f"{meridiem.upper()}M" if meridiem else ''
+
 
 def parse_whatsapp_lines(filepath: str) -> pd.DataFrame:
     """
@@ -38,57 +53,47 @@ def parse_whatsapp_lines(filepath: str) -> pd.DataFrame:
         ValueError: Si el archivo no cumple con el formato esperado o no puede parsear la fecha/hora.
     """
     logger.info(f"parse_whatsapp_lines: Iniciando parseo de {filepath}")
-    pattern = re.compile(
-        r'^(\d{1,2}\/\d{1,2}\/\d{4}),\s*(\d{1,2}:\d{2}\s?[ap]\.?m\.?)\s*-\s*(.*)$',
-        re.IGNORECASE
-    )
-
-    data = []
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, start=1):
-                line = line.strip()
-                match = pattern.match(line)
-                if not match:
-                    # Líneas que no cumplen el formato (mensajes de sistema, etc.)
-                    logger.debug(f"Línea {line_num} no cumple el formato esperado, se ignora.")
-                    continue
-
-                date_str = match.group(1)  # Ej: "3/1/2022"
-                time_str = match.group(2)  # Ej: "8:30 a. m."
-                content = match.group(3)   # Ej: "Nombre: Mensaje"
-
-                # Normalización de la hora (eliminando espacios, reemplazando a.m./p.m.)
-                time_str = (time_str
-                            .replace(' ', '')
-                            .replace('a. m.', 'AM')
-                            .replace('p. m.', 'PM')
-                            .replace('a.m.', 'AM')
-                            .replace('p.m.', 'PM')
-                            .replace('.', '')
-                            .replace(' ', '')
-                           )
-                # Ej final: "8:30AM" o "10:57PM"
-
-                try:
-                    dt = datetime.datetime.strptime(date_str + ' ' + time_str, "%d/%m/%Y %I:%M%p")
-                except ValueError:
-                    logger.debug(f"Línea {line_num}: No se pudo parsear fecha/hora -> {date_str} {time_str}")
-                    continue
-
-                if ': ' in content:
-                    sender, message = content.split(': ', 1)
-                else:
-                    sender = "SYSTEM"
-                    message = content
-
-                data.append({
-                    'datetime': dt,
-                    'sender': sender,
-                    'message': message
-                })
-
-        df = pd.DataFrame(data, columns=["datetime", "sender", "message"])
+        # Lectura con mmap y una única decodificación de todo el archivo
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = ""
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = mm[:].decode('utf-8', errors='replace')
+        lines = pd.Series(data.splitlines(), dtype=object).str.strip()
+
+        # Un único regex con grupos nombrados, evaluado en bloque por pandas
+        parts = lines.str.extract(WHATSAPP_LINE_PATTERN, expand=True)
+        # Líneas que no cumplen el formato (mensajes de sistema, etc.)
+        valid = parts["date"].notna()
+        logger.debug(f"{(~valid).sum()} líneas no cumplen el formato esperado, se ignoran.")
+        parts = parts[valid]
+
+        # Normalización de la hora en una sola pasada (espacios fuera, a.m./p.m. -> AM/PM)
+        time_str = parts["time"].str.replace(WHATSAPP_TIME_FIX, _normalize_meridiem, regex=True)
+        # Ej final: "8:30AM" o "10:57PM"
+
+        dt = pd.to_datetime(
+            parts["date"] + ' ' + time_str,
+            format="%d/%m/%Y %I:%M%p",
+            errors='coerce',
+            cache=True
+        )
+        parsed = dt.notna()
+        logger.debug(f"{(~parsed).sum()} líneas con fecha/hora no parseable, se ignoran.")
+        parts = parts[parsed]
+
+        # Separar "Nombre: Mensaje"; sin remitente => mensaje de sistema
+        content = parts["content"]
+        split = content.str.split(': ', n=1, expand=True).reindex(columns=[0, 1])
+        has_sender = split[1].notna()
+
+        df = pd.DataFrame({
+            'datetime': dt[parsed],
+            'sender': split[0].where(has_sender, "SYSTEM"),
+            'message': split[1].where(has_sender, content)
+        }, columns=["datetime", "sender", "message"]).reset_index(drop=True)
         logger.info(f"parse_whatsapp_lines: Se parsearon {len(df)} mensajes de {filepath}")
         return df
 
@@ -124,58 +129,73 @@ def parse_telegram_html(filepath: str) -> pd.DataFrame:
         ValueError: Si no se puede parsear la fecha/hora o no encuentra contenido.
     """
     logger.info(f"parse_telegram_html: Iniciando parseo de {filepath}")
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            soup = BeautifulSoup(f, 'html.parser')
+    # Importación diferida: lxml solo se carga si hay exportaciones de Telegram
+    from lxml import etree
 
+    try:
         messages_list = []
-        # Buscar todos los divs que contengan mensajes (excluyendo servicios)
-        msg_divs = soup.find_all("div", class_=re.compile(r"message default clearfix"))
         last_sender = None  # Para manejar mensajes "joined" sin from_name
+        div_num = 0
+
+        with open(filepath, 'rb') as f:
+            # Parseo en streaming: se procesa cada <div> al cerrarse y se libera
+            # la memoria de los mensajes ya leídos, sin construir el árbol completo
+            context = etree.iterparse(f, events=("end",), tag="div", html=True, encoding="utf-8")
+            for _, msg_div in context:
+                classes = msg_div.get("class") or ""
+                # Solo interesan los divs que contienen mensajes
+                if "message default clearfix" not in classes:
+                    continue
+                div_num += 1
 
-        for div_num, msg_div in enumerate(msg_divs, start=1):
-            # Omitir mensajes de servicio
-            if "service" in msg_div.get("class", []):
-                logger.debug(f"Div {div_num}: Mensaje de servicio, se ignora.")
-                continue
-
-            date_div = msg_div.find("div", class_="pull_right date details")
-            if not date_div or not date_div.has_attr("title"):
-                logger.debug(f"Div {div_num}: No se encontró date details o 'title'. Se ignora.")
-                continue
-
-            date_str = date_div["title"]  # Ej: "DD.MM.YYYY HH:MM:SS UTC-05:00"
-            parted = date_str.split(" UTC")[0].strip()  # "DD.MM.YYYY HH:MM:SS"
-            try:
-                dt = datetime.datetime.strptime(parted, "%d.%m.%Y %H:%M:%S")
-            except ValueError:
-                logger.debug(f"Div {div_num}: No se pudo parsear fecha/hora -> {parted}")
-                continue
-
-            from_div = msg_div.find("div", class_="from_name")
-            if from_div:
-                sender = from_div.get_text(strip=True)
-                last_sender = sender
-            else:
-                sender = last_sender if last_sender else "Unknown"
-
-            text_div = msg_div.find("div", class_="text")
-            if not text_div:
-                logger.debug(f"Div {div_num}: No se encontró <div class='text'>, se ignora.")
-                continue
-
-            message_text = text_div.get_text("\n", strip=True)
-            if not message_text:
-                logger.debug(f"Div {div_num}: Mensaje vacío, se ignora.")
-                continue
-
-            messages_list.append({
-                "datetime": dt,
-                "sender": sender,
-                "message": message_text
-            })
-
-        df = pd.DataFrame(messages_list, columns=["datetime", "sender", "message"])
+                try:
+                    # Omitir mensajes de servicio
+                    if "service" in classes.split():
+                        logger.debug(f"Div {div_num}: Mensaje de servicio, se ignora.")
+                        continue
+
+                    date_div = msg_div.find(".//div[@class='pull_right date details']")
+                    if date_div is None or date_div.get("title") is None:
+                        logger.debug(f"Div {div_num}: No se encontró date details o 'title'. Se ignora.")
+                        continue
+
+                    date_str = date_div.get("title")  # Ej: "DD.MM.YYYY HH:MM:SS UTC-05:00"
+                    parted = date_str.split(" UTC")[0].strip()  # "DD.MM.YYYY HH:MM:SS"
+                    try:
+                        dt = datetime.datetime.strptime(parted, "%d.%m.%Y %H:%M:%S")
+                    except ValueError:
+                        logger.debug(f"Div {div_num}: No se pudo parsear fecha/hora -> {parted}")
+                        continue
+
+                    from_div = _find_div_by_class(msg_div, "from_name")
+                    if from_div is not None:
+                        sender = "".join(t.strip() for t in from_div.itertext())
+                        last_sender = sender
+                    else:
+                        sender = last_sender if last_sender else "Unknown"
+
+                    text_div = _find_div_by_class(msg_div, "text")
+                    if text_div is None:
+                        logger.debug(f"Div {div_num}: No se encontró <div class='text'>, se ignora.")
+                        continue
+
+                    message_text = "\n".join(t.strip() for t in text_div.itertext() if t.strip())
+                    if not message_text:
+                        logger.debug(f"Div {div_num}: Mensaje vacío, se ignora.")
+                        continue
+
+                    messages_list.append({
+                        "datetime": dt,
+                        "sender": sender,
+                        "message": message_text
+                    })
+                finally:
+                    # Liberar el mensaje procesado y los nodos hermanos anteriores
+                    msg_div.clear()
+                    while msg_div.getprevious() is not None:
+                        del msg_div.getparent()[0]
+
+        df = pd.DataFrame.from_records(messages_list, columns=["datetime", "sender", "message"])
         logger.info(f"parse_telegram_html: Se parsearon {len(df)} mensajes de {filepath}")
         return df
 
@@ -185,3 +205,14 @@ def parse_telegram_html(filepath: str) -> pd.DataFrame:
     except Exception as e:
         logger.error(f"Error inesperado al parsear {filepath}: {e}")
         return pd.DataFrame(columns=["datetime", "sender", "message"])
+
+
+def _find_div_by_class(element, class_name: str):
+    """
+    Devuelve el primer <div> descendiente de 'element' que tenga la clase
+    'class_name' (entre otras posibles), o None si no existe.
+    """
+    matches = element.xpath(
+        f".//div[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')][1]"
+    )
+    return matches[0] if matches else None
@@ -4,130 +4,406 @@ emotion_analysis.py
 Módulo para análisis de emociones usando la API estilo openai (OpenAI, DeepSeek, etc.).
 Incluye una función para clasificar una lista de textos en lotes (batch),
 optimizando el uso de la API para ser más rápido, barato y confiable.
+Los lotes se envían de forma concurrente (asyncio) para solapar la latencia de red,
+y las clasificaciones se guardan en una caché SQLite para no repetir textos.
 
 Autor: JoseAAA
 """
 
-import json
+import os
+import re
+try:
+    import orjson as _json  # Parser JSON más rápido, si está instalado
+except ImportError:
+    import json as _json
+import asyncio
+import hashlib
 import logging
-from typing import List
-import openai
-from config import (
-    OPENAI_API_KEY,
-    OPENAI_API_BASE,
-    OPENAI_API_MODEL,
-    VALID_EMOTIONS,
-    UNKNOWN_EMOTION_LABEL,
-    LANGUAGE
-)
+import sqlite3
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+# La configuración se lee con get_config() al usarla, no al importar el módulo
+from config import EMOTION_CACHE_PATH, get_config
 
 logger = logging.getLogger(__name__)
 
-# Configurar la API (OpenAI, DeepSeek, etc.)
-openai.api_key = OPENAI_API_KEY
-openai.api_base = OPENAI_API_BASE  # "https://api.openai.com" o "https://api.deepseek.com"
+# Tokens de salida reservados por texto cuando max_tokens_response no se fija:
+# una emoción en español ocupa 1-4 tokens más el salto de línea, y en modo JSON
+# se suman la clave numerada, las comillas y la coma
+TOKENS_PER_LINE = 8
+TOKENS_PER_JSON_ENTRY = 16
+
+# Numeración o viñeta que el modelo a veces antepone a cada línea ("1) ", "2. ", "- ")
+LINE_PREFIX_PATTERN = re.compile(r'^\s*(?:\d+\s*[).:-]|[-*•])\s*')
+
+
+@lru_cache(maxsize=1)
+def _valid_emotions_lc() -> frozenset:
+    """
+    Emociones válidas en minúsculas, calculadas una sola vez (al primer uso).
+    """
+    return frozenset(emo.lower() for emo in get_config().VALID_EMOTIONS)
 
 
 def classify_texts_in_bulk(
     texts: List[str],
-    max_per_chunk: int = 50,
-    max_tokens_response: int = 300
+    max_per_chunk: int = 100,
+    max_tokens_response: Optional[int] = None,
+    max_concurrency: int = 16,
+    use_cache: bool = True,
+    json_mode: bool = False
 ) -> List[str]:
     """
     Clasifica una lista de textos en una sola emoción (entre VALID_EMOTIONS),
-    enviándolos en lotes (batch) para reducir el número de llamadas a la API 
+    enviándolos en lotes (batch) para reducir el número de llamadas a la API
     y, por ende, minimizar costos.
 
-    Usa la interfaz openai.chat.completions.create y las variables definidas 
+    Usa la interfaz openai.AsyncOpenAI (chat.completions.create) y las variables definidas
     en config.py (OPENAI_API_KEY, OPENAI_API_BASE, OPENAI_API_MODEL, etc.).
+    Hasta 'max_concurrency' lotes se envían a la vez; los errores transitorios
+    (límite de peticiones, conexión, timeouts) se reintentan con espera exponencial.
 
-    El prompt es minimalista para ahorrar tokens, y se configuran lotes 
-    (max_per_chunk) y un número de tokens para la respuesta (max_tokens_response) 
-    de modo que sea confiable, rápido y barato.
+    Los textos repetidos se envían una sola vez, y las emociones ya clasificadas
+    en ejecuciones anteriores se leen de la caché (EMOTION_CACHE_PATH) en lugar
+    de volver a pedirlas a la API.
+
+    El prompt es minimalista para ahorrar tokens: los textos van uno por línea,
+    sin numerar, y el modelo responde con una emoción por línea en el mismo orden
+    (sin JSON), lo que reduce a la mitad los tokens de salida. Con json_mode=True
+    se usa en su lugar un JSON enumerado con response_format="json_object",
+    para modelos que lo soporten. Se configuran lotes (max_per_chunk) y un número
+    de tokens para la respuesta proporcional al tamaño de cada lote, de modo que
+    sea confiable, rápido y barato.
 
     Args:
         texts (List[str]): Lista de textos a clasificar.
-        max_per_chunk (int, opcional): Tamaño del lote (batch) 
+        max_per_chunk (int, opcional): Tamaño del lote (batch)
             para cada llamada a la API. Lotes más grandes => menos llamadas => menor costo,
-            pero se requiere un 'max_tokens_response' mayor para no truncar el JSON.
-            Por defecto 50.
-        max_tokens_response (int, opcional): Límite de tokens para la respuesta JSON.
-            Subir si se trunca el JSON en lotes grandes. Por defecto 200.
+            pero respuestas más largas. Por defecto 100.
+        max_tokens_response (int, opcional): Límite fijo de tokens para la respuesta
+            de cada lote. Por defecto None, que lo calcula a partir del número de
+            textos del lote (TOKENS_PER_LINE por texto, o TOKENS_PER_JSON_ENTRY en
+            json_mode) para no truncar lotes grandes.
+        max_concurrency (int, opcional): Número máximo de lotes en vuelo
+            al mismo tiempo. Por defecto 16.
+        use_cache (bool, opcional): Si es True, consulta y actualiza la caché
+            persistente de emociones. Por defecto True.
+        json_mode (bool, opcional): Si es True, pide la respuesta como objeto
+            JSON (response_format="json_object") en lugar de una emoción por línea.
+            Por defecto False.
 
     Returns:
-        List[str]: Lista con la emoción clasificada para cada texto, 
-        en el mismo orden que 'texts'. Si no se puede parsear la respuesta 
+        List[str]: Lista con la emoción clasificada para cada texto,
+        en el mismo orden que 'texts'. Si no se puede parsear la respuesta
         o la emoción no coincide con VALID_EMOTIONS, se retorna UNKNOWN_EMOTION_LABEL.
+        Si un lote no devuelve exactamente una emoción por texto, todo el lote
+        queda como UNKNOWN_EMOTION_LABEL.
     """
-    results = []
+    # Deduplicar: cada texto distinto ocupa un solo hueco en los lotes
+    unique_texts = list(dict.fromkeys(texts))
+    cache = _open_cache(EMOTION_CACHE_PATH) if use_cache else None
+    try:
+        known = _cache_get_many(cache, unique_texts) if cache is not None else {}
+        pending = [txt for txt in unique_texts if txt not in known]
+        logger.info(
+            f"{len(texts)} textos: {len(unique_texts)} distintos, "
+            f"{len(known)} en caché, {len(pending)} por clasificar."
+        )
+
+        fresh = asyncio.run(
+            _classify_texts_async(
+                pending, max_per_chunk, max_tokens_response, max_concurrency, cache, json_mode
+            )
+        ) if pending else {}
+    finally:
+        if cache is not None:
+            cache.close()
+
+    known.update(fresh)
+    logger.info("Clasificación de emociones completada.")
+    unknown = get_config().UNKNOWN_EMOTION_LABEL
+    return [known.get(txt, unknown) for txt in texts]
+
+
+async def _classify_texts_async(
+    texts: List[str],
+    max_per_chunk: int,
+    max_tokens_response: Optional[int],
+    max_concurrency: int,
+    cache: Optional[sqlite3.Connection],
+    json_mode: bool
+) -> Dict[str, str]:
+    """
+    Implementación asíncrona de classify_texts_in_bulk: lanza todos los lotes
+    acotados por un semáforo y devuelve un diccionario texto -> emoción.
+    Los lotes que fallan quedan fuera del diccionario (y de la caché).
+    """
+    # Importación diferida: openai solo se carga si se llega a clasificar
+    import openai
+
+    config = get_config()
+    emotions = ', '.join(config.VALID_EMOTIONS)
 
     # Prompt mínimo en 'system' para ahorrar tokens
-    system_prompt = (
-        f"Eres un sistema de clasificación de emociones en {LANGUAGE}. "
-        "Recibirás un bloque de oraciones enumeradas, y tu respuesta debe ser "
-        "EXCLUSIVAMENTE un objeto JSON con la forma:\n"
-        "{ \"1\": \"amor\", \"2\": \"ira\", ... }\n"
-        "sin texto adicional. Emociones posibles: "
-        f"{', '.join(VALID_EMOTIONS)}. No agregues explicaciones."
-        f"Si no coincide, usa \"{UNKNOWN_EMOTION_LABEL}\"."
-    )
+    if json_mode:
+        system_prompt = (
+            f"Eres un sistema de clasificación de emociones en {config.LANGUAGE}. "
+            "Recibirás un bloque de oraciones enumeradas, y tu respuesta debe ser "
+            "EXCLUSIVAMENTE un objeto JSON con la forma:\n"
+            "{ \"1\": \"amor\", \"2\": \"ira\", ... }\n"
+            "sin texto adicional. Emociones posibles: "
+            f"{emotions}. No agregues explicaciones."
+            f"Si no coincide, usa \"{config.UNKNOWN_EMOTION_LABEL}\"."
+        )
+    else:
+        system_prompt = (
+            f"Eres un sistema de clasificación de emociones en {config.LANGUAGE}. "
+            "Recibirás N oraciones, una por línea. Responde con exactamente N líneas, "
+            "una emoción por línea, en el mismo orden que las oraciones, "
+            "sin numeración ni texto adicional. Emociones posibles: "
+            f"{emotions}. No agregues explicaciones. "
+            f"Si no coincide, usa {config.UNKNOWN_EMOTION_LABEL}."
+        )
 
     # Procesar la lista en lotes
     total_texts = len(texts)
-    logger.info(f"Se van a clasificar {total_texts} textos en lotes de {max_per_chunk}.")
+    logger.info(
+        f"Se van a clasificar {total_texts} textos en lotes de {max_per_chunk} "
+        f"(hasta {max_concurrency} lotes concurrentes)."
+    )
+
+    # Configurar la API (OpenAI, DeepSeek, etc.)
+    # OPENAI_API_BASE: "https://api.openai.com/v1" o "https://api.deepseek.com"
+    sem = asyncio.Semaphore(max_concurrency)
+    async with openai.AsyncOpenAI(
+        api_key=config.OPENAI_API_KEY, base_url=config.OPENAI_API_BASE
+    ) as client:
+        starts = range(0, total_texts, max_per_chunk)
+        tasks = [
+            _classify_batch(
+                client,
+                texts[start_idx : start_idx + max_per_chunk],
+                start_idx,
+                sem,
+                system_prompt,
+                max_tokens_response,
+                json_mode,
+                cache
+            )
+            for start_idx in starts
+        ]
+        responses = await asyncio.gather(*tasks, return_exceptions=True)
 
-    for start_idx in range(0, total_texts, max_per_chunk):
+    results = {}
+    for start_idx, labels in zip(starts, responses):
+        if isinstance(labels, BaseException):
+            logger.error(f"Error inesperado en el lote {start_idx}: {labels}")
+            continue
+        if labels is None:
+            continue
         batch = texts[start_idx : start_idx + max_per_chunk]
-        logger.debug(f"Lote de {len(batch)} textos, índice {start_idx} a {start_idx + len(batch) - 1}.")
+        results.update(zip(batch, labels))
+    return results
+
+
+async def _classify_batch(
+    client,
+    batch: List[str],
+    start_idx: int,
+    sem: asyncio.Semaphore,
+    system_prompt: str,
+    max_tokens_response: Optional[int],
+    json_mode: bool,
+    cache: Optional[sqlite3.Connection]
+) -> Optional[List[str]]:
+    """
+    Clasifica un único lote de textos con una llamada a la API y, si se pudo
+    parsear la respuesta, lo guarda en caché de inmediato (así una ejecución
+    interrumpida conserva los lotes ya terminados).
 
+    Returns:
+        Optional[List[str]]: Emociones del lote en orden, o None si la llamada
+        falla tras los reintentos o no se puede parsear la respuesta (en ese caso
+        todo el lote queda como UNKNOWN_EMOTION_LABEL y no se guarda en caché).
+    """
+    import openai
+    from tenacity import (
+        AsyncRetrying,
+        retry_if_exception_type,
+        stop_after_attempt,
+        wait_exponential
+    )
+
+    logger.debug(f"Lote de {len(batch)} textos, índice {start_idx} a {start_idx + len(batch) - 1}.")
+
+    # Una oración por línea: los saltos de línea internos romperían la alineación
+    lines = [" ".join(txt.split()) for txt in batch]
+
+    if json_mode:
         # Crear un texto enumerado
         enumerated_text = "\n".join(
-            f"{i+1}) {txt}" for i, txt in enumerate(batch)
+            f"{i+1}) {txt}" for i, txt in enumerate(lines)
         )
-
         user_prompt = (
             "Clasifica cada oración enumerada en una de las emociones. "
             "Devuelve SOLO un JSON. Ejemplo:\n"
             "{ \"1\": \"alegría\", \"2\": \"ira\" }\n\n"
             f"{enumerated_text}"
         )
+        extra_params = {"response_format": {"type": "json_object"}}
+    else:
+        user_prompt = f"N={len(lines)}\n" + "\n".join(lines)
+        extra_params = {}
 
-        try:
-            response = openai.chat.completions.create(
-                model=OPENAI_API_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user",   "content": user_prompt}
-                ],
-                temperature=0.0,  # Evita respuestas largas y creativas
-                max_tokens=max_tokens_response
-            )
-            content = response.choices[0].message.content.strip()
-            logger.debug(f"Respuesta de la API (lote {start_idx}): {content[:100]}...")
-
-            # Parsear el JSON devuelto
-            try:
-                parsed_json = json.loads(content)
-            except json.JSONDecodeError:
-                logger.warning(f"No se pudo parsear el JSON en el lote {start_idx}:\n{content}")
-                # Llenar con UNKNOWN_EMOTION_LABEL para este lote
-                for _ in batch:
-                    results.append(UNKNOWN_EMOTION_LABEL)
-                continue
-
-            # Extraer la emoción para cada texto en este lote
-            for i in range(len(batch)):
-                key = str(i + 1)
-                raw_emo = parsed_json.get(key, UNKNOWN_EMOTION_LABEL).lower()
-                if raw_emo not in [emo.lower() for emo in VALID_EMOTIONS]:
-                    raw_emo = UNKNOWN_EMOTION_LABEL
-                results.append(raw_emo)
-
-        except Exception as e:
-            logger.error(f"Error al llamar a la API en el lote {start_idx}: {e}")
-            # Si falla la llamada entera, llenamos con UNKNOWN_EMOTION_LABEL
-            for _ in batch:
-                results.append(UNKNOWN_EMOTION_LABEL)
+    if max_tokens_response is None:
+        # Cada texto necesita su propia línea (o entrada JSON) en la respuesta
+        per_text = TOKENS_PER_JSON_ENTRY if json_mode else TOKENS_PER_LINE
+        max_tokens_response = len(batch) * per_text
 
-    logger.info("Clasificación de emociones completada.")
+    try:
+        async with sem:
+            # Reintentos con espera exponencial ante errores transitorios de la API
+            async for attempt in AsyncRetrying(
+                retry=retry_if_exception_type((
+                    openai.RateLimitError,
+                    openai.APIConnectionError,
+                    openai.APITimeoutError,
+                    openai.InternalServerError
+                )),
+                wait=wait_exponential(multiplier=1, max=30),
+                stop=stop_after_attempt(5),
+                reraise=True
+            ):
+                with attempt:
+                    response = await client.chat.completions.create(
+                        model=get_config().OPENAI_API_MODEL,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user",   "content": user_prompt}
+                        ],
+                        temperature=0.0,  # Evita respuestas largas y creativas
+                        max_tokens=max_tokens_response,
+                        **extra_params
+                    )
+        content = response.choices[0].message.content.strip()
+        logger.debug(f"Respuesta de la API (lote {start_idx}): {content[:100]}...")
+
+    except Exception as e:
+        logger.error(f"Error al llamar a la API en el lote {start_idx}: {e}")
+        # Si falla la llamada entera, el lote queda como UNKNOWN_EMOTION_LABEL
+        return None
+
+    if json_mode:
+        labels = _parse_json_response(content, len(batch), start_idx)
+    else:
+        labels = _parse_lines_response(content, len(batch), start_idx)
+
+    # Todo corre en el mismo hilo del event loop: la conexión SQLite se puede compartir
+    if labels is not None and cache is not None:
+        _cache_set_many(cache, dict(zip(batch, labels)))
+    return labels
+
+
+def _parse_json_response(content: str, n_expected: int, start_idx: int) -> Optional[List[str]]:
+    """
+    Parsea una respuesta JSON enumerada ({"1": "amor", ...}).
+
+    Returns:
+        Optional[List[str]]: Emociones en orden, o None si la respuesta no es
+        un objeto JSON válido.
+    """
+    try:
+        parsed_json = _json.loads(content)
+    except _json.JSONDecodeError:
+        parsed_json = None
+    if not isinstance(parsed_json, dict):
+        logger.warning(f"No se pudo parsear el JSON en el lote {start_idx}:\n{content}")
+        # El lote queda como UNKNOWN_EMOTION_LABEL
+        return None
+
+    # Extraer la emoción para cada texto en este lote
+    unknown = get_config().UNKNOWN_EMOTION_LABEL
+    valid = _valid_emotions_lc()
+    results = []
+    for i in range(n_expected):
+        key = str(i + 1)
+        raw_emo = str(parsed_json.get(key, unknown)).lower()
+        results.append(raw_emo if raw_emo in valid else unknown)
     return results
+
+
+def _parse_lines_response(content: str, n_expected: int, start_idx: int) -> Optional[List[str]]:
+    """
+    Parsea una respuesta con una emoción por línea.
+
+    Returns:
+        Optional[List[str]]: Emociones en orden, o None si el número de líneas
+        no coincide con el de textos del lote (no se puede saber cuál falta).
+    """
+    labels = [
+        LINE_PREFIX_PATTERN.sub('', line).strip().strip('"\'.,').lower()
+        for line in content.splitlines()
+        if line.strip()
+    ]
+    if len(labels) != n_expected:
+        logger.warning(
+            f"El lote {start_idx} devolvió {len(labels)} líneas en lugar de {n_expected}:\n{content}"
+        )
+        return None
+    unknown = get_config().UNKNOWN_EMOTION_LABEL
+    valid = _valid_emotions_lc()
+    return [emo if emo in valid else unknown for emo in labels]
+
+
+# -------------------------------------------------------
+# Caché persistente de clasificaciones (SQLite)
+# -------------------------------------------------------
+
+def _cache_key(text: str) -> str:
+    """
+    Clave de caché de un texto: depende del modelo y de las emociones válidas,
+    para no reutilizar etiquetas obtenidas con otra configuración.
+    """
+    config = get_config()
+    raw = f"{config.OPENAI_API_MODEL}|{','.join(config.VALID_EMOTIONS)}|{text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _open_cache(path: str) -> sqlite3.Connection:
+    """
+    Abre (y crea si no existe) la base SQLite de la caché de emociones.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS emotions (key TEXT PRIMARY KEY, emotion TEXT NOT NULL)")
+    return conn
+
+
+def _cache_get_many(conn: sqlite3.Connection, texts: Iterable[str], chunk_size: int = 500) -> Dict[str, str]:
+    """
+    Devuelve un diccionario texto -> emoción con los textos que ya están en caché.
+    Las consultas se hacen por bloques para respetar el límite de parámetros de SQLite.
+    """
+    key_to_text = {_cache_key(txt): txt for txt in texts}
+    keys = list(key_to_text)
+    found = {}
+    for start_idx in range(0, len(keys), chunk_size):
+        chunk = keys[start_idx : start_idx + chunk_size]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(
+            f"SELECT key, emotion FROM emotions WHERE key IN ({placeholders})", chunk
+        )
+        for key, emotion in rows:
+            found[key_to_text[key]] = emotion
+    return found
+
+
+def _cache_set_many(conn: sqlite3.Connection, results: Dict[str, str]) -> None:
+    """
+    Guarda en caché las emociones de un lote (texto -> emoción).
+    """
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO emotions (key, emotion) VALUES (?, ?)",
+            [(_cache_key(txt), emo) for txt, emo in results.items()]
+        )
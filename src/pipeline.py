@@ -7,7 +7,7 @@ Script principal que orquesta:
 3) Extracción de emojis (mensaje_emojis)
 4) Limpieza de texto (message_clean)
 5) Análisis de emociones por lotes
-6) Guardado en Excel
+6) Guardado en Parquet y Excel
 
 Incluye logging para un mejor seguimiento de la ejecución.
 
@@ -16,114 +16,139 @@ Autor: JoseAAA
 
 import os
 import logging
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import pandas as pd
 
 # Importar configuración y funciones
-from config import (
-    DATA_DIR,
-    WHATSAPP_SENDER_MAPPING,
-    TELEGRAM_SENDER_MAPPING,
-    SENDER_FALLBACK
-)
+# Solo rutas a nivel de módulo: el resto de la configuración se lee en main(),
+# para que los procesos hijos (spawn) no carguen .env al importar este módulo
+from config import DATA_DIR, get_config
 from data_parsers import parse_whatsapp_lines, parse_telegram_html
-from text_cleaning import clean_text, extract_emojis
+from text_cleaning import clean_texts, extract_emojis_bulk, warmup
 from emotion_analysis import classify_texts_in_bulk
 
 logger = logging.getLogger(__name__)
 
+
+def _list_files(directory: str, extension: str, tipo: str) -> List[str]:
+    """
+    Devuelve las rutas de los archivos de 'directory' con la extensión indicada.
+    Si el directorio no existe, registra una advertencia y devuelve una lista vacía.
+    """
+    if not os.path.exists(directory):
+        logger.warning(f"No se encontró el directorio de {tipo}: {directory}")
+        return []
+    return [
+        os.path.join(directory, fname)
+        for fname in os.listdir(directory)
+        if fname.endswith(extension)
+    ]
+
+
+def _parse_files_in_parallel(jobs: List[Tuple[Callable[[str], pd.DataFrame], str, str]]) -> Dict[str, pd.DataFrame]:
+    """
+    Ejecuta los parsers en paralelo con un único ProcessPoolExecutor compartido.
+
+    Args:
+        jobs: Lista de tuplas (parser, ruta_archivo, tipo), p. ej.
+              (parse_whatsapp_lines, "data/raw/WhatsApp/chat.txt", "WhatsApp").
+
+    Returns:
+        Dict[str, pd.DataFrame]: DataFrame parseado por ruta. Los archivos que
+        fallan se registran en el log y no se incluyen.
+    """
+    if not jobs:
+        return {}
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as executor:
+        futures = {}
+        for parser, full_path, tipo in jobs:
+            logger.info(f"Procesando archivo {tipo}: {full_path}")
+            futures[executor.submit(parser, full_path)] = full_path
+
+        for future in as_completed(futures):
+            full_path = futures[future]
+            try:
+                results[full_path] = future.result()
+            except Exception as e:
+                logger.error(f"Error al parsear {full_path}: {e}")
+    return results
+
+
 def main():
     """
     Punto de entrada principal del pipeline.
 
-    1) Carga y parsea mensajes de WhatsApp y Telegram desde data/raw/.
+    1) Carga y parsea mensajes de WhatsApp y Telegram desde data/raw/
+       (un proceso por archivo).
     2) Aplica un mapeo de remitentes (definido en config.py)
        para homogeneizar nombres en el reporte.
     3) Extrae los emojis en una columna 'message_emoji'.
     4) Limpia y normaliza el texto en 'message_clean'.
     5) Clasifica las emociones por lotes (classify_texts_in_bulk)
        para reducir costos en la API.
-    6) Guarda el resultado final en data/processed/mensajes_procesados.xlsx.
+    6) Guarda el resultado final en data/processed/data_messages.parquet
+       y data/processed/data_messages.xlsx.
     """
 
     logger.info("Iniciando pipeline de procesamiento de mensajes...")
+    # Carga .env aquí (y no al importar) para fallar pronto si falta la API key
+    config = get_config()
 
-    # 1. Cargar datos de WhatsApp
-    whatsapp_dir = os.path.join(DATA_DIR, "raw", "WhatsApp")
-    if not os.path.exists(whatsapp_dir):
-        logger.warning(f"No se encontró el directorio de WhatsApp: {whatsapp_dir}")
-
-    all_whatsapp_dfs = []
-    for fname in os.listdir(whatsapp_dir):
-        if fname.endswith(".txt"):
-            full_path = os.path.join(whatsapp_dir, fname)
-            logger.info(f"Procesando archivo WhatsApp: {full_path}")
-            try:
-                df_part = parse_whatsapp_lines(full_path)
-                all_whatsapp_dfs.append(df_part)
-            except Exception as e:
-                logger.error(f"Error al parsear {full_path}: {e}")
+    # 1. Localizar archivos de WhatsApp y Telegram
+    whatsapp_files = _list_files(os.path.join(DATA_DIR, "raw", "WhatsApp"), ".txt", "WhatsApp")
+    telegram_files = _list_files(os.path.join(DATA_DIR, "raw", "Telegram"), ".html", "Telegram")
 
-    if all_whatsapp_dfs:
-        df_whatsapp = pd.concat(all_whatsapp_dfs, ignore_index=True)
-        df_whatsapp.sort_values("datetime", inplace=True)
-        df_whatsapp.reset_index(drop=True, inplace=True)
-        logger.info(f"WhatsApp: Se cargaron {df_whatsapp.shape[0]} mensajes.")
-    else:
-        logger.warning("No se encontraron mensajes de WhatsApp.")
-        df_whatsapp = pd.DataFrame(columns=["datetime", "sender", "message"])
-
-    # Mapear remitentes según config.py
-    if not df_whatsapp.empty:
-        df_whatsapp["sender"] = df_whatsapp["sender"].map(WHATSAPP_SENDER_MAPPING).fillna(SENDER_FALLBACK)
-        df_whatsapp["tipo"] = "WhatsApp"
-
-    # 2. Cargar datos de Telegram
-    telegram_dir = os.path.join(DATA_DIR, "raw", "Telegram")
-    if not os.path.exists(telegram_dir):
-        logger.warning(f"No se encontró el directorio de Telegram: {telegram_dir}")
-
-    all_telegram_dfs = []
-    for fname in os.listdir(telegram_dir):
-        if fname.endswith(".html"):
-            full_path = os.path.join(telegram_dir, fname)
-            logger.info(f"Procesando archivo Telegram: {full_path}")
-            try:
-                df_part = parse_telegram_html(full_path)
-                all_telegram_dfs.append(df_part)
-            except Exception as e:
-                logger.error(f"Error al parsear {full_path}: {e}")
+    # Parsear todos los archivos en paralelo (un proceso por archivo)
+    parsed = _parse_files_in_parallel(
+        [(parse_whatsapp_lines, path, "WhatsApp") for path in whatsapp_files]
+        + [(parse_telegram_html, path, "Telegram") for path in telegram_files]
+    )
 
-    if all_telegram_dfs:
-        df_telegram = pd.concat(all_telegram_dfs, ignore_index=True)
-        df_telegram.sort_values("datetime", inplace=True)
-        df_telegram.reset_index(drop=True, inplace=True)
-        logger.info(f"Telegram: Se cargaron {df_telegram.shape[0]} mensajes.")
-    else:
-        logger.warning("No se encontraron mensajes de Telegram.")
-        df_telegram = pd.DataFrame(columns=["datetime", "sender", "message"])
-
-    if not df_telegram.empty:
-        df_telegram["sender"] = df_telegram["sender"].map(TELEGRAM_SENDER_MAPPING).fillna(SENDER_FALLBACK)
-        df_telegram["tipo"] = "Telegram"
-
-    # 3. Unificar ambos DataFrames y ordenar cronológicamente
-    if df_whatsapp.empty and df_telegram.empty:
+    # 2. Mapear remitentes (según config.py) y etiquetar el origen de cada archivo,
+    #    para después unificar todo con una sola concatenación
+    all_dfs = []
+    for files, sender_mapping, tipo in (
+        (whatsapp_files, config.WHATSAPP_SENDER_MAPPING, "WhatsApp"),
+        (telegram_files, config.TELEGRAM_SENDER_MAPPING, "Telegram"),
+    ):
+        source_dfs = [parsed[path] for path in files if path in parsed and not parsed[path].empty]
+        n_messages = sum(len(df_part) for df_part in source_dfs)
+        if n_messages:
+            logger.info(f"{tipo}: Se cargaron {n_messages} mensajes.")
+        else:
+            logger.warning(f"No se encontraron mensajes de {tipo}.")
+
+        for df_part in source_dfs:
+            df_part["sender"] = df_part["sender"].map(sender_mapping).fillna(config.SENDER_FALLBACK)
+            df_part["tipo"] = tipo
+        all_dfs.extend(source_dfs)
+
+    # 3. Unificar todos los archivos y ordenar cronológicamente (una sola copia y un solo orden)
+    if not all_dfs:
         logger.warning("No hay datos de WhatsApp ni de Telegram para procesar.")
         return
 
-    df = pd.concat([df_whatsapp, df_telegram], ignore_index=True)
-    df.sort_values("datetime", inplace=True)
-    df.reset_index(drop=True, inplace=True)
+    df = pd.concat(all_dfs, ignore_index=True)
+    df.sort_values("datetime", inplace=True, kind="stable", ignore_index=True)
+    # Pocos valores distintos y muy repetidos: como categorías ocupan menos memoria
+    df["sender"] = df["sender"].astype("category")
+    df["tipo"] = df["tipo"].astype("category")
     logger.info(f"Mensajes unificados: {df.shape[0]} filas.")
 
     # 4. Extraer emojis y limpiar texto
     logger.info("Extrayendo emojis y limpiando texto...")
-    df["message_emoji"] = df["message"].apply(extract_emojis)   # Nueva columna con los emojis
-    df["message_clean"] = df["message"].apply(clean_text)        # Limpieza del texto
+    warmup()  # Carga spaCy y stopwords una sola vez, antes de procesar
+    df["message_emoji"] = extract_emojis_bulk(df["message"])    # Nueva columna con los emojis
+    # Limpieza del texto (por lotes); los mensajes de menos de 2 palabras
+    # no pasan por spaCy porque el filtro siguiente los descartaría igual
+    df["message_clean"] = clean_texts(df["message"], min_tokens=2)
 
     # Filtrar mensajes muy cortos
-    df["n_tokens"] = df["message_clean"].apply(lambda x: len(x.split()))
+    df["n_tokens"] = df["message_clean"].str.count(r"\S+")
     df_filtrado = df[df["n_tokens"] > 1].copy()
     logger.info(f"Mensajes con más de 1 token: {df_filtrado.shape[0]}")
 
@@ -132,17 +157,21 @@ def main():
     texts_to_classify = df_filtrado["message_clean"].tolist()
     emotions_pred = classify_texts_in_bulk(
         texts=texts_to_classify,
-        max_per_chunk=30,         # Ajusta según tus necesidades
-        max_tokens_response=300   # Suficiente para ~50 items
+        max_per_chunk=100   # Ajusta según tus necesidades; max_tokens se calcula por lote
     )
-    df_filtrado["emotion"] = emotions_pred
+    df_filtrado["emotion"] = pd.Categorical(emotions_pred)
+
+    # 6. Guardar resultado en Parquet (formato principal) y en Excel (para Power BI)
+    output_dir = Path(DATA_DIR) / "processed"
+    output_dir.mkdir(parents=True, exist_ok=True)
 
-    # 6. Guardar resultado en Excel
-    output_path = Path(DATA_DIR) / "processed" / "data_messages.xlsx"
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    df_filtrado.to_excel(output_path, index=False)
+    parquet_path = output_dir / "data_messages.parquet"
+    df_filtrado.to_parquet(parquet_path, index=False, engine="pyarrow", compression="zstd")
+    logger.info(f"Archivo Parquet guardado en: {parquet_path}")
 
-    logger.info(f"Archivo Excel guardado en: {output_path}")
+    excel_path = output_dir / "data_messages.xlsx"
+    df_filtrado.to_excel(excel_path, index=False, engine="xlsxwriter")
+    logger.info(f"Archivo Excel guardado en: {excel_path}")
     logger.info("Pipeline completado con éxito.")
 
 
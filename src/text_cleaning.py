@@ -10,18 +10,60 @@ Autor: JoseAAA
 import re
 import regex
 import logging
-import spacy
-import nltk
-from nltk.corpus import stopwords
-from config import CUSTOM_STOPWORDS
+from functools import lru_cache
+import pandas as pd
+try:
+    import emoji  # Detección completa de emojis (ZWJ, tonos de piel, banderas), si está instalado
+except ImportError:
+    emoji = None
 
 logger = logging.getLogger(__name__)
 
-nlp = spacy.load("es_core_news_sm")
+# Componentes de spaCy que no se usan en la limpieza
+NLP_DISABLED_COMPONENTS = ["parser", "ner", "attribute_ruler"]
+
+
+# -------------------------------------------------------
+# Recursos pesados (importaciones diferidas)
+# -------------------------------------------------------
+# spaCy, su modelo y NLTK tardan varios segundos en cargarse, así que se
+# importan dentro de estas funciones y se cachean: solo se pagan si alguna
+# etapa realmente limpia texto, y una única vez por proceso.
+
+@lru_cache(maxsize=1)
+def _get_nlp():
+    """
+    Carga (una sola vez) el modelo de spaCy para español.
+    """
+    import spacy
+    logger.info("Cargando modelo de spaCy 'es_core_news_sm'...")
+    return spacy.load("es_core_news_sm", disable=NLP_DISABLED_COMPONENTS)
+
+
+@lru_cache(maxsize=1)
+def _get_stopwords() -> frozenset:
+    """
+    Construye (una sola vez) el conjunto de stopwords: spaCy + NLTK + personalizadas.
+    Se guardan en minúsculas para comparar directamente con token.lower_.
+    """
+    from nltk.corpus import stopwords
+    from config import CUSTOM_STOPWORDS
+
+    stopwords_spacy = _get_nlp().Defaults.stop_words
+    stopwords_nltk = set(stopwords.words("spanish"))
+    return frozenset(
+        word.lower() for word in stopwords_spacy.union(stopwords_nltk).union(CUSTOM_STOPWORDS)
+    )
+
+
+def warmup() -> None:
+    """
+    Fuerza la carga del modelo de spaCy y de las stopwords antes de limpiar texto,
+    para que el coste quede fuera del procesamiento por lotes.
+    """
+    _get_nlp()
+    _get_stopwords()
 
-stopwords_spacy = nlp.Defaults.stop_words
-stopwords_nltk = set(stopwords.words("spanish"))
-spanish_stopwords = stopwords_spacy.union(stopwords_nltk).union(CUSTOM_STOPWORDS)
 
 URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
 EMOJI_PATTERN = regex.compile(
@@ -37,12 +79,33 @@ MENTION_PATTERN = re.compile(r'@\w+')
 PHONE_PATTERN = re.compile(r'\+\d{1,3}[- ]?\d{6,14}')
 DATE_PATTERN = re.compile(r'\b\d{1,2}[/-]\d{1,2}[/-]\d{2,4}\b')
 TIME_PATTERN = re.compile(r'\b\d{1,2}:\d{2}\b')
+NUMBER_PATTERN = re.compile(r'\b\d+\b')
 REPEATED_CHARS = re.compile(r'(.)\1{2,}')
+PUNCT_PATTERN = re.compile(r'[^\w\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# Todo emoji contiene algún carácter fuera de ASCII: filtro barato antes de usar 'emoji'
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7f]')
+
+# Patrones que se eliminan del texto antes de pasar por spaCy.
+# EMOJI_PATTERN solo se usa si no está instalado el paquete 'emoji'.
+SCRUB_PATTERNS = (
+    URL_PATTERN,
+    *(() if emoji is not None else (EMOJI_PATTERN,)),
+    MENTION_PATTERN,
+    PHONE_PATTERN,
+    DATE_PATTERN,
+    TIME_PATTERN,
+    NUMBER_PATTERN,  # Al final: fechas, horas y teléfonos tienen prioridad en la alternación
+)
+# Alternación única de todos los patrones anteriores: una sola pasada por texto
+MASTER_PATTERN = re.compile("|".join(f"(?:{p.pattern})" for p in SCRUB_PATTERNS))
 
 
 def extract_emojis(text: str) -> str:
     """
     Extrae todos los emojis de un texto y los devuelve concatenados en orden de aparición.
+    Usa el paquete 'emoji' si está instalado y EMOJI_PATTERN en caso contrario.
 
     Args:
         text (str): El texto original con emojis.
@@ -54,17 +117,55 @@ def extract_emojis(text: str) -> str:
     if not text.strip():
         return ''
 
+    if emoji is not None:
+        # Unir los emojis contiguos, igual que los grupos que captura EMOJI_PATTERN
+        runs = []
+        last_end = None
+        for match in emoji.emoji_list(text):
+            if runs and match['match_start'] == last_end:
+                runs[-1] += match['emoji']
+            else:
+                runs.append(match['emoji'])
+            last_end = match['match_end']
+        return ' '.join(runs)
+
     # Buscar todos los match de EMOJI_PATTERN y concatenarlos
     found_emojis = EMOJI_PATTERN.findall(text)
     return ' '.join(found_emojis)
 
 
+def extract_emojis_bulk(texts: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de extract_emojis para una Serie completa de mensajes,
+    usando los métodos .str de pandas en lugar de una llamada por fila.
+    Con el paquete 'emoji' solo se analizan los textos con caracteres no ASCII,
+    y cada texto distinto una sola vez.
+
+    Args:
+        texts (pd.Series): Serie con los textos originales.
+
+    Returns:
+        pd.Series: Serie con los emojis de cada texto separados por espacios
+                   (cadena vacía si no hay ninguno), con el mismo índice que 'texts'.
+    """
+    texts = texts.astype(object).fillna("")
+    if emoji is None:
+        return texts.str.findall(EMOJI_PATTERN.pattern).str.join(' ')
+
+    found = pd.Series("", index=texts.index, dtype=object)
+    mask = texts.str.contains(NON_ASCII_PATTERN).to_numpy()
+    candidates = texts[mask]
+    emojis_by_text = {text: extract_emojis(text) for text in candidates.drop_duplicates()}
+    found[mask] = candidates.map(emojis_by_text).to_numpy()
+    return found
+
+
 def clean_text(text: str) -> str:
     """
     Limpia y normaliza un texto en español:
     
     1) Convierte a minúsculas y elimina saltos de línea.
-    2) Elimina URLs, emojis, menciones, teléfonos, fechas y horas.
+    2) Elimina URLs, emojis, menciones, teléfonos, fechas, horas y números.
     3) Quita puntuación, reduce repeticiones y espacios extra.
     4) Lematiza con spaCy y filtra stopwords (incluyendo las personalizadas).
 
@@ -80,21 +181,104 @@ def clean_text(text: str) -> str:
 
     text = text.lower().replace("\n", " ").replace("\r", " ")
 
-    text = URL_PATTERN.sub('', text)
-    text = EMOJI_PATTERN.sub('', text)
-    text = MENTION_PATTERN.sub('', text)
-    text = PHONE_PATTERN.sub('', text)
-    text = DATE_PATTERN.sub('', text)
-    text = TIME_PATTERN.sub('', text)
+    if emoji is not None:
+        text = emoji.replace_emoji(text, replace=' ')
+    text = MASTER_PATTERN.sub(' ', text)
 
-    text = re.sub(r'[^\w\s]', ' ', text)
+    text = PUNCT_PATTERN.sub(' ', text)
     text = REPEATED_CHARS.sub(r'\1', text)
-    text = re.sub(r'\s+', ' ', text).strip()
+    text = WHITESPACE_PATTERN.sub(' ', text).strip()
+
+    doc = _get_nlp()(text)
+    return _join_tokens(doc, _get_stopwords())
+
+
+def clean_texts(
+    texts: pd.Series,
+    batch_size: int = 1000,
+    n_process: int = -1,
+    min_tokens: int = 0
+) -> pd.Series:
+    """
+    Versión por lotes de clean_text para una Serie completa de mensajes.
+
+    1) Aplica las mismas limpiezas con regex que clean_text, pero vectorizadas
+       con los métodos .str de pandas.
+    2) Procesa el texto resultante con nlp.pipe (por lotes y en varios procesos),
+       con el modelo cargado sin los componentes de spaCy que no se usan.
+
+    Los textos que tras el paso 1 tienen menos de 'min_tokens' palabras no pasan
+    por spaCy (que solo puede quitar palabras) y se devuelven como cadena vacía.
+    Los textos repetidos tras el paso 1 se procesan con spaCy una sola vez.
 
-    doc = nlp(text)
-    tokens = [
+    Args:
+        texts (pd.Series): Serie con los textos originales.
+        batch_size (int, opcional): Textos por lote en nlp.pipe. Por defecto 1000.
+        n_process (int, opcional): Procesos para nlp.pipe (-1 usa todos los
+            núcleos disponibles). Por defecto -1.
+        min_tokens (int, opcional): Mínimo de palabras tras la limpieza con regex
+            para procesar un texto con spaCy. Por defecto 0 (se procesan todos).
+
+    Returns:
+        pd.Series: Serie con los textos limpios, con el mismo índice que 'texts'.
+    """
+    if texts.empty:
+        return pd.Series([], index=texts.index, dtype=object)
+
+    # dtype object: con el dtype 'str' (pyarrow) los patrones en texto van a RE2,
+    # donde \w y \s solo reconocen ASCII y se romperían las tildes y la ñ
+    prescrubbed = (texts.astype(object).fillna("")
+                   .str.lower()
+                   .str.replace("\n", " ", regex=False)
+                   .str.replace("\r", " ", regex=False))
+
+    if emoji is not None:
+        mask = prescrubbed.str.contains(NON_ASCII_PATTERN).to_numpy()
+        prescrubbed.loc[mask] = (prescrubbed[mask]
+                                 .map(lambda text: emoji.replace_emoji(text, replace=' '))
+                                 .to_numpy())
+
+    prescrubbed = (prescrubbed
+                   .str.replace(MASTER_PATTERN, ' ', regex=True)
+                   .str.replace(PUNCT_PATTERN, ' ', regex=True)
+                   .str.replace(REPEATED_CHARS, r'\1', regex=True)
+                   .str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+                   .str.strip())
+
+    # Descartar antes de spaCy los textos demasiado cortos
+    mask = (prescrubbed.str.count(r"\S+") >= min_tokens).to_numpy()
+    to_process = prescrubbed[mask]
+    # Los chats repiten mucho ("ok", "jaja", "gracias"): spaCy solo ve cada texto una vez
+    unique_texts = to_process.drop_duplicates().tolist()
+
+    spanish_stopwords = _get_stopwords()
+    docs = _get_nlp().pipe(
+        unique_texts,
+        batch_size=batch_size,
+        n_process=n_process
+    )
+    logger.info(
+        f"clean_texts: Limpiando {len(unique_texts)} textos distintos "
+        f"({len(to_process)} de {len(texts)}) con nlp.pipe."
+    )
+    cleaned_by_text = {
+        text: _join_tokens(doc, spanish_stopwords) for text, doc in zip(unique_texts, docs)
+    }
+    cleaned = pd.Series("", index=texts.index, dtype=object)
+    cleaned[mask] = to_process.map(cleaned_by_text).to_numpy()
+    return cleaned
+
+
+def _join_tokens(doc, spanish_stopwords: frozenset) -> str:
+    """
+    Une los tokens de un Doc de spaCy que no son stopwords ni números.
+
+    Las cifras ya se eliminan con MASTER_PATTERN antes de spaCy; like_num se
+    mantiene para los números escritos con letras ("diez", "cien") y es
+    un flag precalculado del léxico, no una evaluación por token.
+    """
+    return ' '.join(
         token.lower_
         for token in doc
-        if token.text.lower() not in spanish_stopwords and not token.like_num
-    ]
-    return ' '.join(tokens)
+        if token.lower_ not in spanish_stopwords and not token.like_num
+    )
@@ -0,0 +1,67 @@
+"""
+test_text_cleaning.py
+
+Pruebas de regresión para text_cleaning: la versión por lotes (clean_texts)
+debe dar el mismo resultado que clean_text, sea cual sea el dtype de la Serie.
+
+Usa un modelo de spaCy en blanco para no depender de 'es_core_news_sm'.
+"""
+
+import os
+import sys
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+spacy = pytest.importorskip("spacy")
+pytest.importorskip("regex")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import text_cleaning  # noqa: E402
+
+ACCENTED_TEXTS = [
+    "Mañana será un día increíble, amigo… línea",
+    "llamar mañana temprano",
+    "número b2b",
+    "día feliz 😀😀 🎉",
+    "¿Qué pasó? ¡Niño!",
+]
+
+
+@pytest.fixture(autouse=True)
+def blank_nlp(monkeypatch):
+    nlp = spacy.blank("es")
+    monkeypatch.setattr(text_cleaning, "_get_nlp", lambda: nlp)
+    monkeypatch.setattr(
+        text_cleaning, "_get_stopwords", lambda: frozenset(nlp.Defaults.stop_words)
+    )
+
+
+@pytest.mark.parametrize("dtype", [object, "str"])
+def test_clean_texts_matches_clean_text(dtype):
+    try:
+        texts = pd.Series(ACCENTED_TEXTS, dtype=dtype)
+    except TypeError:
+        pytest.skip(f"dtype {dtype!r} no disponible en esta versión de pandas")
+
+    expected = [text_cleaning.clean_text(text) for text in ACCENTED_TEXTS]
+    assert text_cleaning.clean_texts(texts, n_process=1).tolist() == expected
+    assert "mañana increíble amigo línea" in expected
+
+
+@pytest.mark.parametrize("dtype", [object, "str"])
+def test_clean_texts_all_non_ascii(dtype):
+    try:
+        texts = pd.Series(["llamar mañana temprano", "número b2b", "día feliz"], dtype=dtype)
+    except TypeError:
+        pytest.skip(f"dtype {dtype!r} no disponible en esta versión de pandas")
+
+    expected = [text_cleaning.clean_text(text) for text in texts]
+    assert text_cleaning.clean_texts(texts, n_process=1).tolist() == expected
+
+
+def test_extract_emojis_keeps_runs_together():
+    assert text_cleaning.extract_emojis("hola 😀😀 y 🎉") == "😀😀 🎉"
+    texts = pd.Series(["hola 😀😀 y 🎉", "sin emojis", ""])
+    assert text_cleaning.extract_emojis_bulk(texts).tolist() == ["😀😀 🎉", "", ""]